@@ -1,16 +1,8 @@
 from pydantic_settings import BaseSettings
+from functools import lru_cache
 from typing import Optional
 import os
 
-# Added Settings class in config.py
-class Settings(BaseSettings):
-    # ... existing config ...
-    
-    # Database for conversation history
-    DATABASE_URL: str = "sqlite:///./data/conversations.db"
-    ENABLE_HISTORY: bool = True
-    HISTORY_RETENTION_DAYS: int = 30
-
 class Settings(BaseSettings):
     # Project
     PROJECT_NAME: str = "TUK-ConvoSearch"
@@ -24,6 +16,17 @@ class Settings(BaseSettings):
     
     # Model Config
     EMBEDDING_MODEL: str = "all-MiniLM-L6-v2"  # Lightweight, good quality
+    EMBEDDING_BATCH_SIZE: int = 64
+    EMBEDDING_DEVICE: Optional[str] = None  # "cuda" or "cpu"; auto-detected when unset
+    EMBEDDING_HALF_PRECISION: bool = True  # bf16/fp16 weights when running on CUDA
+    # Dynamic int8 linear layers when running on CPU. Opt-in: int8 embeddings differ from
+    # the fp32 ones already indexed, so re-index (clear VECTOR_DB_PATH, re-upload) after enabling
+    EMBEDDING_QUANTIZE_CPU: bool = False
+    VECTOR_ADD_BATCH_SIZE: int = 1024  # Documents embedded and inserted per batch
+    COMPRESS_DOCUMENT_TEXT: bool = True  # Keep chunk text in a zstd sidecar instead of Chroma
+    QUERY_EMBEDDING_CACHE_SIZE: int = 2048
+    QUERY_BATCH_SIZE: int = 32  # Concurrent queries encoded together
+    QUERY_BATCH_WAIT_MS: float = 10  # How long to wait for a batch to fill
     CHUNK_SIZE: int = 1000
     CHUNK_OVERLAP: int = 200
     
@@ -39,7 +42,35 @@ class Settings(BaseSettings):
     TOP_K_RESULTS: int = 4
     SIMILARITY_THRESHOLD: float = 0.7
     
+    # HNSW index parameters for new vector collections
+    HNSW_M: int = 24
+    HNSW_CONSTRUCTION_EF: int = 128
+    HNSW_SEARCH_EF: int = 128
+    
+    # Semantic cache for near-duplicate searches
+    SEMANTIC_CACHE_SIZE: int = 256
+    SEMANTIC_CACHE_PLANES: int = 16
+    SEMANTIC_CACHE_THRESHOLD: float = 0.95
+    
+    # Database for conversation history
+    DATABASE_URL: str = "sqlite:///./data/conversations.db"
+    ENABLE_HISTORY: bool = True
+    HISTORY_RETENTION_DAYS: int = 30
+    
+    # Context limits for the LLM prompt (characters)
+    MAX_CONTEXT_CHARS: int = 6000
+    MAX_CHARS_PER_DOC: int = 1500
+    
+    # Response cache for repeated queries
+    QUERY_CACHE_SIZE: int = 512
+    QUERY_CACHE_TTL: int = 3600  # seconds
+    
     class Config:
         env_file = ".env"
 
-settings = Settings()
\ No newline at end of file
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Return the shared settings instance, parsing the environment only once"""
+    return Settings()
+
+settings = get_settings()
\ No newline at end of file
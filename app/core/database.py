@@ -1,19 +1,31 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Boolean, JSON
+from sqlalchemy import create_engine, event, select, delete, func, case, text, Column, Index, Integer, String, Text, DateTime, Boolean, JSON
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, StaticPool
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 import json
 from loguru import logger
+import queue
+import time
 
 Base = declarative_base()
 
 class Conversation(Base):
     """Model for storing conversation history"""
     __tablename__ = "conversations"
+    __table_args__ = (
+        # History lookups filter on one of these and sort newest first
+        Index("ix_user_created", "user_id", "created_at"),
+        Index("ix_conv_created", "conversation_id", "created_at"),
+        # Retention cleanup and daily statistics range over created_at
+        Index("ix_created_at", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     conversation_id = Column(String, unique=True, index=True)  # Unique ID for each chat session
-    user_id = Column(String, index=True, default="anonymous")  # Could be student ID in production
+    user_id = Column(String, default="anonymous")  # Could be student ID in production
     query = Column(Text)
     answer = Column(Text)
     confidence = Column(Integer)  # 0-100
@@ -29,21 +41,35 @@ class Conversation(Base):
             "query": self.query,
             "answer": self.answer,
             "confidence": self.confidence,
-            "sources_used": json.loads(self.sources_used) if self.sources_used else [],
+            "sources_used": self._decode_sources(self.sources_used),
             "created_at": self.created_at.isoformat(),
             "helpful_feedback": self.helpful_feedback
         }
+    
+    @staticmethod
+    def _decode_sources(sources_used):
+        """Return sources as a list, decoding rows saved as JSON strings by older versions"""
+        if isinstance(sources_used, str):
+            return json.loads(sources_used)
+        return sources_used or []
 
 class DatabaseManager:
     """Manages conversation history database operations"""
     
+    CLEANUP_BATCH_SIZE = 1000
+    
     def __init__(self, config):
         self.config = config
         self.engine = None
         self.SessionLocal = None
         
+        # Background writer for history saves off the request path
+        self._executor = None
+        self._pending = queue.Queue(maxsize=1000)
+        
         if config.ENABLE_HISTORY:
             self._init_database()
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-writer")
     
     def _init_database(self):
         """Initialize SQLite database"""
@@ -52,60 +78,178 @@ class DatabaseManager:
             import os
             os.makedirs("data", exist_ok=True)
             
-            # Create engine
+            # Create engine with a persistent pool so connections (and their
+            # PRAGMAs) are reused across calls instead of reopened per request
+            if self._is_sqlite_file():
+                pool_kwargs = {"poolclass": QueuePool, "pool_size": 1, "max_overflow": 4}
+            else:
+                # In-memory SQLite must share a single connection to see its tables
+                pool_kwargs = {"poolclass": StaticPool}
+            
             self.engine = create_engine(
                 self.config.DATABASE_URL,
-                connect_args={"check_same_thread": False}  # Needed for SQLite
+                connect_args={"check_same_thread": False},  # Needed for SQLite; busy_timeout is set by the PRAGMA hook
+                pool_pre_ping=False,
+                **pool_kwargs
             )
             
+            # Tune SQLite for concurrent reads/writes (file-backed databases only)
+            if self._is_sqlite_file():
+                event.listen(self.engine, "connect", self._set_sqlite_pragmas)
+            
             # Create tables
             Base.metadata.create_all(bind=self.engine)
             
+            # create_all skips existing tables, so add any indexes they are missing
+            for index in Conversation.__table__.indexes:
+                index.create(bind=self.engine, checkfirst=True)
+            
             # Create session factory
             self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
             
             logger.info("Conversation history database initialized")
             
         except Exception as e:
-            logger.error(f"Failed to initialize database: {e}")
+            logger.error("Failed to initialize database: {}", e)
             raise
     
+    @contextmanager
+    def _session(self):
+        """Provide a session from the shared pool, closing it afterwards"""
+        db = self.SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+    
+    def _is_sqlite_file(self) -> bool:
+        """Check whether DATABASE_URL points at an on-disk SQLite database"""
+        url = self.config.DATABASE_URL
+        return url.startswith("sqlite") and ":memory:" not in url and url.rstrip("/") not in ("sqlite:", "sqlite+pysqlite:")
+    
+    @staticmethod
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        """Enable WAL and relaxed fsync on every new SQLite connection"""
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute("PRAGMA temp_store=MEMORY")
+            cursor.execute("PRAGMA cache_size=-64000")  # ~64MB page cache
+            cursor.execute("PRAGMA mmap_size=268435456")  # 256MB
+            cursor.execute("PRAGMA busy_timeout=5000")
+        finally:
+            cursor.close()
+    
     def save_conversation(self, conversation_data: dict) -> dict:
         """Save a conversation to database"""
         if not self.SessionLocal:
             return {"success": False, "error": "Database not initialized"}
         
         try:
-            db = self.SessionLocal()
-            
-            conversation = Conversation(
-                conversation_id=conversation_data.get("conversation_id"),
-                user_id=conversation_data.get("user_id", "anonymous"),
-                query=conversation_data.get("query", ""),
-                answer=conversation_data.get("answer", ""),
-                confidence=conversation_data.get("confidence", 0),
-                sources_used=json.dumps(conversation_data.get("sources_used", [])),
-                helpful_feedback=conversation_data.get("helpful_feedback")
-            )
+            with self._session() as db:
+                conversation = Conversation(**self._conversation_row(conversation_data))
             
-            db.add(conversation)
-            db.commit()
-            db.refresh(conversation)
+                db.add(conversation)
+                db.commit()
+                db.refresh(conversation)
             
-            logger.info(f"Saved conversation: {conversation.id}")
+                logger.info("Saved conversation: {}", conversation.id)
             
-            return {
-                "success": True,
-                "conversation_id": conversation.conversation_id,
-                "id": conversation.id
-            }
+                return {
+                    "success": True,
+                    "conversation_id": conversation.conversation_id,
+                    "id": conversation.id
+                }
             
         except Exception as e:
-            logger.error(f"Error saving conversation: {e}")
+            logger.error("Error saving conversation: {}", e)
             return {"success": False, "error": str(e)}
-        finally:
-            if db:
-                db.close()
+    
+    def save_conversation_async(self, conversation_data: dict) -> dict:
+        """Queue a conversation to be saved by the background writer"""
+        if not self._executor:
+            return self.save_conversation(conversation_data)
+        
+        try:
+            self._pending.put_nowait(conversation_data)
+        except queue.Full:
+            # Writer is falling behind; save inline rather than drop history
+            logger.warning("History queue full, saving conversation synchronously")
+            return self.save_conversation(conversation_data)
+        
+        self._executor.submit(self._flush_pending)
+        
+        return {
+            "success": True,
+            "queued": True,
+            "conversation_id": conversation_data.get("conversation_id")
+        }
+    
+    def _flush_pending(self):
+        """Drain queued conversations and write them in one transaction"""
+        batch = []
+        while True:
+            try:
+                batch.append(self._pending.get_nowait())
+            except queue.Empty:
+                break
+        
+        # Earlier flushes may already have picked up everything
+        if not batch:
+            return
+        
+        # One bad row (e.g. a duplicate conversation_id) fails the whole transaction,
+        # so retry row by row to keep every valid conversation
+        if not self.save_conversations_bulk(batch)["success"]:
+            for conversation_data in batch:
+                self.save_conversation(conversation_data)
+    
+    def close(self):
+        """Flush pending history writes and release database resources"""
+        if self._executor:
+            self._executor.submit(self._flush_pending)
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        
+        if self.engine:
+            self.engine.dispose()
+    
+    def save_conversations_bulk(self, conversations: list) -> dict:
+        """Save many conversations in a single transaction"""
+        if not self.SessionLocal:
+            return {"success": False, "error": "Database not initialized"}
+        
+        if not conversations:
+            return {"success": True, "count": 0}
+        
+        try:
+            rows = [self._conversation_row(data) for data in conversations]
+            
+            with self.SessionLocal.begin() as db:
+                db.bulk_insert_mappings(Conversation, rows)
+            
+            logger.info("Saved {} conversations in bulk", len(rows))
+            
+            return {"success": True, "count": len(rows)}
+            
+        except Exception as e:
+            logger.error("Error bulk saving conversations: {}", e)
+            return {"success": False, "error": str(e)}
+    
+    @staticmethod
+    def _conversation_row(conversation_data: dict) -> dict:
+        """Map incoming conversation data to Conversation column values"""
+        return {
+            "conversation_id": conversation_data.get("conversation_id"),
+            "user_id": conversation_data.get("user_id", "anonymous"),
+            "query": conversation_data.get("query", ""),
+            "answer": conversation_data.get("answer", ""),
+            "confidence": conversation_data.get("confidence", 0),
+            "sources_used": conversation_data.get("sources_used", []),
+            "helpful_feedback": conversation_data.get("helpful_feedback"),
+            "created_at": conversation_data.get("created_at") or datetime.utcnow()
+        }
     
     def get_conversation_history(self, conversation_id: str = None, user_id: str = None, limit: int = 20) -> list:
         """Get conversation history for a session or user"""
@@ -113,26 +257,22 @@ class DatabaseManager:
             return []
         
         try:
-            db = self.SessionLocal()
-            
-            query = db.query(Conversation)
+            with self._session() as db:
+                query = db.query(Conversation)
             
-            if conversation_id:
-                query = query.filter(Conversation.conversation_id == conversation_id)
-            elif user_id:
-                query = query.filter(Conversation.user_id == user_id)
+                if conversation_id:
+                    query = query.filter(Conversation.conversation_id == conversation_id)
+                elif user_id:
+                    query = query.filter(Conversation.user_id == user_id)
             
-            # Get latest conversations
-            conversations = query.order_by(Conversation.created_at.desc()).limit(limit).all()
+                # Get latest conversations
+                conversations = query.order_by(Conversation.created_at.desc()).limit(limit).all()
             
-            return [conv.to_dict() for conv in conversations]
+                return [conv.to_dict() for conv in conversations]
             
         except Exception as e:
-            logger.error(f"Error fetching history: {e}")
+            logger.error("Error fetching history: {}", e)
             return []
-        finally:
-            if db:
-                db.close()
     
     def update_feedback(self, conversation_id: str, helpful: bool) -> bool:
         """Update feedback for a conversation"""
@@ -140,26 +280,22 @@ class DatabaseManager:
             return False
         
         try:
-            db = self.SessionLocal()
+            with self._session() as db:
+                conversation = db.query(Conversation).filter(
+                    Conversation.conversation_id == conversation_id
+                ).first()
             
-            conversation = db.query(Conversation).filter(
-                Conversation.conversation_id == conversation_id
-            ).first()
+                if conversation:
+                    conversation.helpful_feedback = helpful
+                    db.commit()
+                    logger.info("Updated feedback for conversation {}: {}", conversation_id, helpful)
+                    return True
             
-            if conversation:
-                conversation.helpful_feedback = helpful
-                db.commit()
-                logger.info(f"Updated feedback for conversation {conversation_id}: {helpful}")
-                return True
-            
-            return False
+                return False
             
         except Exception as e:
-            logger.error(f"Error updating feedback: {e}")
+            logger.error("Error updating feedback: {}", e)
             return False
-        finally:
-            if db:
-                db.close()
     
     def cleanup_old_conversations(self):
         """Clean up conversations older than retention period"""
@@ -167,24 +303,39 @@ class DatabaseManager:
             return
         
         try:
-            db = self.SessionLocal()
-            
-            cutoff_date = datetime.utcnow() - timedelta(days=self.config.HISTORY_RETENTION_DAYS)
-            
-            deleted_count = db.query(Conversation).filter(
-                Conversation.created_at < cutoff_date
-            ).delete()
-            
-            db.commit()
-            
-            if deleted_count > 0:
-                logger.info(f"Cleaned up {deleted_count} old conversations")
+            with self._session() as db:
+                cutoff_date = datetime.utcnow() - timedelta(days=self.config.HISTORY_RETENTION_DAYS)
+                
+                # Delete in small batches so the write lock is released between
+                # transactions and concurrent writers are not stalled
+                expired_ids = select(Conversation.id).where(
+                    Conversation.created_at < cutoff_date
+                ).limit(self.CLEANUP_BATCH_SIZE)
+                
+                deleted_count = 0
+                while True:
+                    batch_count = db.execute(
+                        delete(Conversation).where(Conversation.id.in_(expired_ids))
+                    ).rowcount
+                    db.commit()
+                    deleted_count += batch_count
+                    
+                    if batch_count < self.CLEANUP_BATCH_SIZE:
+                        break
+                    
+                    # Give readers and other writers a chance to run
+                    time.sleep(0.01)
+                
+                if deleted_count > 0:
+                    logger.info("Cleaned up {} old conversations", deleted_count)
+                    
+                    # Return freed pages to the OS when incremental auto-vacuum is enabled
+                    if self._is_sqlite_file() and db.execute(text("PRAGMA auto_vacuum")).scalar() == 2:
+                        db.execute(text("PRAGMA incremental_vacuum"))
+                        db.commit()
             
         except Exception as e:
-            logger.error(f"Error cleaning up old conversations: {e}")
-        finally:
-            if db:
-                db.close()
+            logger.error("Error cleaning up old conversations: {}", e)
     
     def get_statistics(self) -> dict:
         """Get conversation statistics"""
@@ -192,33 +343,27 @@ class DatabaseManager:
             return {}
         
         try:
-            db = self.SessionLocal()
-            
-            total_conversations = db.query(Conversation).count()
-            
-            helpful_count = db.query(Conversation).filter(
-                Conversation.helpful_feedback == True
-            ).count()
-            
-            unhelpful_count = db.query(Conversation).filter(
-                Conversation.helpful_feedback == False
-            ).count()
+            with self._session() as db:
+                today = datetime.utcnow().date()
+                today_start = datetime(today.year, today.month, today.day)
+                
+                # One pass over the table instead of a COUNT query per figure
+                total_conversations, helpful_count, unhelpful_count, today_conversations = db.execute(
+                    select(
+                        func.count(),
+                        func.coalesce(func.sum(case((Conversation.helpful_feedback == True, 1), else_=0)), 0),
+                        func.coalesce(func.sum(case((Conversation.helpful_feedback == False, 1), else_=0)), 0),
+                        func.coalesce(func.sum(case((Conversation.created_at >= today_start, 1), else_=0)), 0)
+                    ).select_from(Conversation)
+                ).one()
             
-            today = datetime.utcnow().date()
-            today_conversations = db.query(Conversation).filter(
-                Conversation.created_at >= datetime(today.year, today.month, today.day)
-            ).count()
-            
-            return {
-                "total_conversations": total_conversations,
-                "helpful_feedback": helpful_count,
-                "unhelpful_feedback": unhelpful_count,
-                "today_conversations": today_conversations
-            }
+                return {
+                    "total_conversations": total_conversations,
+                    "helpful_feedback": helpful_count,
+                    "unhelpful_feedback": unhelpful_count,
+                    "today_conversations": today_conversations
+                }
             
         except Exception as e:
-            logger.error(f"Error getting statistics: {e}")
-            return {}
-        finally:
-            if db:
-                db.close()
\ No newline at end of file
+            logger.error("Error getting statistics: {}", e)
+            return {}
\ No newline at end of file
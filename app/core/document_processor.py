@@ -1,12 +1,16 @@
 import os
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
 from loguru import logger
-import PyPDF2
+import fitz  # PyMuPDF
 from docx import Document as DocxDocument
-import json
+import hashlib
+import pickle
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+SUPPORTED_EXTENSIONS = ['.pdf', '.docx', '.txt', '.md', '.json']
 
 class DocumentProcessor:
     def __init__(self, config):
@@ -28,12 +32,13 @@ class DocumentProcessor:
             elif ext == '.docx':
                 return self._load_docx(file_path)
             elif ext in ['.txt', '.md']:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    return f.read()
+                # Binary read in one call skips text-mode newline translation
+                with open(file_path, 'rb') as f:
+                    return f.read(os.path.getsize(file_path)).decode('utf-8', errors='replace')
             elif ext == '.json':
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    return json.dumps(data, indent=2)
+                # The chunker only needs text, so skip the parse/re-serialize round-trip
+                with open(file_path, 'rb') as f:
+                    return f.read().decode('utf-8')
             else:
                 logger.warning(f"Unsupported file type: {ext}")
                 return ""
@@ -43,63 +48,121 @@ class DocumentProcessor:
     
     def _load_pdf(self, file_path: str) -> str:
         """Extract text from PDF"""
-        text = ""
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-        return text
+        with fitz.open(file_path) as doc:
+            return "\n".join(page.get_text() for page in doc)
     
     def _load_docx(self, file_path: str) -> str:
         """Extract text from DOCX"""
         doc = DocxDocument(file_path)
-        return "\n".join([para.text for para in doc.paragraphs])
+        return "\n".join(para.text for para in doc.paragraphs)
     
     def chunk_document(self, text: str, metadata: Dict) -> List[Document]:
         """Split document into chunks"""
         if not text.strip():
             return []
         
-        # Create initial document
-        doc = Document(page_content=text, metadata=metadata)
+        # Split the raw text directly and attach chunk metadata as each Document is built
+        texts = self.text_splitter.split_text(text)
+        total_chunks = len(texts)
+        chunks = [
+            Document(
+                page_content=chunk_text,
+                metadata={**metadata, "chunk_id": i, "total_chunks": total_chunks}
+            )
+            for i, chunk_text in enumerate(texts)
+        ]
         
-        # Split into chunks
-        chunks = self.text_splitter.split_documents([doc])
+        logger.info(f"Created {len(chunks)} chunks from {metadata.get('source', 'unknown')}")
+        return chunks
+    
+    def process_file(self, file_path: Path) -> List[Document]:
+        """Load and chunk a single document, reusing cached chunks if unchanged"""
+        stat = file_path.stat()
+        cache_key = f"{stat.st_mtime_ns}-{stat.st_size}-{self.config.CHUNK_SIZE}-{self.config.CHUNK_OVERLAP}"
+        cache_path = Path(self.config.PROCESSED_DIR) / f"{hashlib.sha1(str(file_path).encode()).hexdigest()}.pkl"
         
-        # Add chunk-specific metadata
-        for i, chunk in enumerate(chunks):
-            chunk.metadata.update({
-                "chunk_id": i,
-                "total_chunks": len(chunks)
-            })
+        cached = self._load_cached_chunks(cache_path, cache_key)
+        if cached is not None:
+            logger.info(f"Using cached chunks for: {file_path.name}")
+            return cached
         
-        logger.info(f"Created {len(chunks)} chunks from {metadata.get('source', 'unknown')}")
+        logger.info(f"Processing: {file_path.name}")
+        
+        # Load document
+        text = self.load_document(str(file_path))
+        
+        if not text:
+            return []
+        
+        # Create metadata
+        metadata = {
+            "source": file_path.name,
+            "file_path": str(file_path),
+            "file_type": file_path.suffix.lower(),
+            "file_size": stat.st_size
+        }
+        
+        # Chunk document
+        chunks = self.chunk_document(text, metadata)
+        self._save_cached_chunks(cache_path, cache_key, chunks)
         return chunks
     
+    def _load_cached_chunks(self, cache_path: Path, cache_key: str):
+        """Return cached chunks if the cache entry matches, otherwise None"""
+        if not cache_path.exists():
+            return None
+        
+        try:
+            with open(cache_path, 'rb') as f:
+                cached = pickle.load(f)
+            if cached.get("key") == cache_key:
+                return cached["chunks"]
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable chunk cache {cache_path}: {e}")
+        
+        return None
+    
+    def _save_cached_chunks(self, cache_path: Path, cache_key: str, chunks: List[Document]):
+        """Persist chunks so unchanged files are not re-parsed on the next run"""
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(cache_path, 'wb') as f:
+                pickle.dump({"key": cache_key, "chunks": chunks}, f, protocol=5)
+        except Exception as e:
+            logger.warning(f"Failed to write chunk cache {cache_path}: {e}")
+    
+    def iter_directory(self, directory_path: str) -> Iterator[List[Document]]:
+        """Yield each file's chunks as soon as a worker process finishes it"""
+        directory = Path(directory_path)
+        
+        file_paths = [
+            file_path for file_path in directory.rglob('*')
+            if file_path.is_file() and file_path.suffix.lower() in SUPPORTED_EXTENSIONS
+        ]
+        
+        if not file_paths:
+            return
+        
+        # Parsing and splitting are CPU-bound, so fan files out across processes.
+        # Files go to workers one at a time: per-file work is heavy and uneven.
+        max_workers = min(os.cpu_count() or 1, len(file_paths))
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(_process_one, file_path, self.config) for file_path in file_paths]
+            # Completion order, so one large file doesn't hold back the ones behind it
+            for future in as_completed(futures):
+                yield future.result()
+    
     def process_directory(self, directory_path: str) -> List[Document]:
         """Process all documents in a directory"""
         all_chunks = []
-        directory = Path(directory_path)
-        
-        for file_path in directory.rglob('*'):
-            if file_path.is_file() and file_path.suffix.lower() in ['.pdf', '.docx', '.txt', '.md', '.json']:
-                logger.info(f"Processing: {file_path.name}")
-                
-                # Load document
-                text = self.load_document(str(file_path))
-                
-                if text:
-                    # Create metadata
-                    metadata = {
-                        "source": file_path.name,
-                        "file_path": str(file_path),
-                        "file_type": file_path.suffix.lower(),
-                        "file_size": file_path.stat().st_size
-                    }
-                    
-                    # Chunk document
-                    chunks = self.chunk_document(text, metadata)
-                    all_chunks.extend(chunks)
+        for chunks in self.iter_directory(directory_path):
+            all_chunks.extend(chunks)
         
         logger.info(f"Total chunks created: {len(all_chunks)}")
-        return all_chunks
\ No newline at end of file
+        return all_chunks
+
+
+def _process_one(file_path: Path, config) -> List[Document]:
+    """Process a single file in a worker process"""
+    # Build the processor (and its splitter) inside the worker rather than pickling one
+    return DocumentProcessor(config).process_file(file_path)
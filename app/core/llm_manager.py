@@ -2,7 +2,7 @@ from typing import Dict, Any, Optional
 from langchain.llms import Ollama
 from langchain.chat_models import ChatOpenAI
 from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
+from langchain.schema.output_parser import StrOutputParser
 from loguru import logger
 import os
 
@@ -11,6 +11,7 @@ class LLMManager:
         self.config = config
         self.llm = None
         self.prompt_template = None
+        self.chain = None
         
         self._init_llm()
         self._init_prompt_template()
@@ -46,35 +47,37 @@ class LLMManager:
     
     def _init_prompt_template(self):
         """Initialize the prompt template for RAG"""
+        # Static instructions come first so the serving backend can reuse its cached
+        # prefix (KV states) across queries; only context and question vary
         template = """You are TUK-ConvoSearch, an AI assistant for the Technical University of Kenya. Your purpose is to provide accurate, helpful information to students and staff based ONLY on the provided context.
 
-Context Information:
-{context}
-
-User Question: {question}
-
 Instructions:
-1. Answer STRICTLY based on the context provided above
+1. Answer STRICTLY based on the context provided below
 2. If the answer is not in the context, say "I cannot find specific information about this in the official TUK documents. Please contact the relevant department for assistance."
 3. Keep answers concise and clear
 4. If relevant, mention the source document
 5. Format important dates, deadlines, or procedures clearly
 
+Context Information:
+{context}
+
+User Question: {question}
+
 Answer:"""
 
         self.prompt_template = PromptTemplate(
             input_variables=["context", "question"],
             template=template
         )
+        
+        # Build the runnable once; chat and completion models both yield plain text
+        self.chain = self.prompt_template | self.llm | StrOutputParser()
     
     def generate_response(self, question: str, context: str) -> Dict[str, Any]:
         """Generate response using LLM with RAG"""
         try:
-            # Create chain
-            chain = LLMChain(llm=self.llm, prompt=self.prompt_template)
-            
             # Generate response
-            response = chain.run(context=context, question=question)
+            response = self.chain.invoke({"context": context, "question": question})
             
             return {
                 "answer": response.strip(),
@@ -0,0 +1,73 @@
+from concurrent.futures import Future
+from typing import Callable, List
+from loguru import logger
+import numpy as np
+import queue
+import threading
+import time
+
+class QueryBatcher:
+    """Coalesces concurrent single-query encode requests into batched calls"""
+    
+    def __init__(self, encode_fn: Callable[[List[str]], np.ndarray], max_batch_size: int = 32, max_wait_ms: float = 10):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        
+        self._worker = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+        self._worker.start()
+    
+    def encode(self, text: str) -> np.ndarray:
+        """Encode one query, sharing a batch with any requests arriving alongside it"""
+        future = Future()
+        with self._pending_lock:
+            self._pending += 1
+        self._queue.put((text, future))
+        return future.result()
+    
+    def _run(self):
+        """Encode queued queries together, waiting up to max_wait only while other callers are in flight"""
+        while True:
+            batch = [self._queue.get()]
+            
+            # Take whatever is already queued without waiting
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            # An isolated query is encoded immediately; the wait only pays off
+            # when more callers are already on their way to the queue
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                with self._pending_lock:
+                    waiting_for_more = self._pending > len(batch)
+                remaining = deadline - time.monotonic()
+                if not waiting_for_more or remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            try:
+                embeddings = self.encode_fn([text for text, _ in batch])
+            except Exception as e:
+                logger.error(f"Batched query encoding failed: {e}")
+                self._finish(len(batch))
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            
+            self._finish(len(batch))
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+    
+    def _finish(self, count: int):
+        """Stop counting a batch's callers as in flight before their results are released"""
+        with self._pending_lock:
+            self._pending -= count
\ No newline at end of file
@@ -1,6 +1,12 @@
 from typing import Dict, Any, List
+from datetime import datetime
 from loguru import logger
+from cachetools import TTLCache
+import numpy as np
+import threading
 import json
+import re
+import uuid
 
 # Add to RAGPipeline class __init__
 class RAGPipeline:
@@ -9,15 +15,33 @@ class RAGPipeline:
         self.vector_store = vector_store
         self.llm_manager = llm_manager
         self.db_manager = db_manager  # Add database manager
+        
+        # Cache of final responses for repeated questions
+        self._response_cache = TTLCache(maxsize=config.QUERY_CACHE_SIZE, ttl=config.QUERY_CACHE_TTL)
+        self._cache_lock = threading.Lock()
+        self._cache_version = 0  # Bumped when the indexed documents change
     
     # Update process_query method
     def process_query(self, query: str, conversation_id: str = None, user_id: str = "anonymous") -> Dict[str, Any]:
         """Process a query through the full RAG pipeline with history tracking"""
         try:
-            logger.info(f"Processing query: {query}")
+            logger.info("Processing query: {}", query)
+            
+            # Repeat questions skip retrieval and generation entirely
+            cache_key = self._cache_key(query)
+            cached = self._get_cached_response(cache_key)
+            if cached is not None:
+                logger.info("Serving cached response")
+                response = {**cached, "conversation_id": conversation_id}
+                self._save_to_history(response, query, conversation_id, user_id)
+                return response
             
             # Step 1: Retrieve relevant documents
             retrieved_docs = self.vector_store.search(query)
+            logger.opt(lazy=True).debug(
+                "Retrieved sources: {}",
+                lambda: [doc["metadata"].get("source", "Unknown") for doc in retrieved_docs]
+            )
             
             if not retrieved_docs:
                 response = {
@@ -26,22 +50,27 @@ class RAGPipeline:
                     "confidence": 0.0,
                     "error": None
                 }
+                # Not cached: search returns [] on failures too, which must not stick for the TTL
                 self._save_to_history(response, query, conversation_id, user_id)
                 return response
             
-            # Filter by similarity threshold
-            filtered_docs = [
-                doc for doc in retrieved_docs 
-                if doc["similarity_score"] >= self.config.SIMILARITY_THRESHOLD
-            ]
+            # Filter by similarity threshold with vectorized score comparisons
+            scores = np.fromiter(
+                (doc["similarity_score"] for doc in retrieved_docs),
+                dtype=np.float64,
+                count=len(retrieved_docs)
+            )
+            mask = scores >= self.config.SIMILARITY_THRESHOLD
+            filtered_docs = [retrieved_docs[i] for i in np.flatnonzero(mask)]
             
             if not filtered_docs:
                 response = {
                     "answer": "The information I found doesn't meet the confidence threshold for accuracy. Please consult official sources directly.",
                     "sources": retrieved_docs,
-                    "confidence": max([doc["similarity_score"] for doc in retrieved_docs]),
+                    "confidence": float(scores.max()),
                     "error": None
                 }
+                self._cache_response(cache_key, response)
                 self._save_to_history(response, query, conversation_id, user_id)
                 return response
             
@@ -55,13 +84,15 @@ class RAGPipeline:
             result = {
                 "answer": llm_response["answer"],
                 "sources": filtered_docs,
-                "confidence": sum([doc["similarity_score"] for doc in filtered_docs]) / len(filtered_docs),
+                "confidence": float(scores[mask].mean()),
                 "sources_used": llm_response["sources_used"],
                 "error": llm_response["error"],
                 "conversation_id": conversation_id
             }
             
-            logger.info(f"Query processed successfully. Confidence: {result['confidence']:.2f}")
+            logger.info("Query processed successfully. Confidence: {:.2f}", result['confidence'])
+            
+            self._cache_response(cache_key, result)
             
             # Save to history
             self._save_to_history(result, query, conversation_id, user_id)
@@ -69,7 +100,7 @@ class RAGPipeline:
             return result
             
         except Exception as e:
-            logger.error(f"Pipeline error: {e}")
+            logger.error("Pipeline error: {}", e)
             return {
                 "answer": "An error occurred while processing your query. Please try again.",
                 "sources": [],
@@ -77,11 +108,35 @@ class RAGPipeline:
                 "error": str(e)
             }
     
+    def _cache_key(self, query: str) -> tuple:
+        """Build a cache key from the normalized query and current index version"""
+        return (self._cache_version, re.sub(r'\s+', ' ', query.strip().lower()))
+    
+    def _get_cached_response(self, cache_key: tuple):
+        """Return a cached response for the key, or None"""
+        with self._cache_lock:
+            return self._response_cache.get(cache_key)
+    
+    def _cache_response(self, cache_key: tuple, response: dict):
+        """Cache a successful response, without its per-conversation fields"""
+        if response.get("error"):
+            return
+        
+        cached = {k: v for k, v in response.items() if k != "conversation_id"}
+        with self._cache_lock:
+            self._response_cache[cache_key] = cached
+    
+    def invalidate_cache(self):
+        """Drop cached responses, e.g. after new documents are indexed"""
+        with self._cache_lock:
+            self._cache_version += 1
+            self._response_cache.clear()
+    
     def _save_to_history(self, response: dict, query: str, conversation_id: str, user_id: str):
         """Save conversation to history database"""
         if self.db_manager and self.config.ENABLE_HISTORY:
             conversation_data = {
-                "conversation_id": conversation_id or f"conv_{int(datetime.now().timestamp())}",
+                "conversation_id": conversation_id or f"conv_{int(datetime.now().timestamp())}_{uuid.uuid4().hex[:8]}",
                 "user_id": user_id,
                 "query": query,
                 "answer": response.get("answer", ""),
@@ -95,7 +150,7 @@ class RAGPipeline:
                 ]
             }
             
-            self.db_manager.save_conversation(conversation_data)
+            self.db_manager.save_conversation_async(conversation_data)
     
     # Add new method to get conversation history
     def get_conversation_history(self, conversation_id: str = None, user_id: str = None, limit: int = 10) -> list:
@@ -106,15 +161,39 @@ class RAGPipeline:
     
     def _prepare_context(self, documents: List[Dict]) -> str:
         """Prepare context from retrieved documents"""
+        # Cap prompt size: LLM latency grows with the number of input tokens
+        remaining = self.config.MAX_CONTEXT_CHARS
         context_parts = []
         
         for i, doc in enumerate(documents):
-            source_info = f"[Source: {doc['metadata'].get('source', 'Unknown')}]"
-            content = doc['content']
-            context_parts.append(f"Document {i+1} {source_info}:\n{content}\n")
+            # Documents are ordered by relevance, so stop once the budget is spent
+            if remaining <= 0:
+                break
+            
+            # The last document that fits is cut down to the remaining budget
+            content = self._truncate_content(doc['content'], min(self.config.MAX_CHARS_PER_DOC, remaining))
+            
+            context_parts.append(
+                f"Document {i+1} [Source: {doc['metadata'].get('source', 'Unknown')}]:\n{content}\n"
+            )
+            remaining -= len(content)
         
         return "\n---\n".join(context_parts)
     
+    @staticmethod
+    def _truncate_content(content: str, max_chars: int) -> str:
+        """Truncate content to max_chars, preferring to end on a sentence boundary"""
+        if len(content) <= max_chars:
+            return content
+        
+        truncated = content[:max_chars]
+        sentence_end = truncated.rfind('. ')
+        
+        # Only cut at the sentence boundary if it keeps most of the allowed text
+        if sentence_end > max_chars // 2:
+            return truncated[:sentence_end + 1]
+        return truncated
+    
     def get_system_info(self) -> Dict[str, Any]:
         """Get system information and statistics"""
         vector_stats = self.vector_store.get_collection_stats()
@@ -0,0 +1,51 @@
+from typing import List, Tuple
+from loguru import logger
+import zstandard
+import threading
+import os
+
+class CompressedTextStore:
+    """Append-only file of individually zstd-compressed texts addressed by offset"""
+    
+    def __init__(self, path: str, level: int = 3):
+        self.path = path
+        # zstd (de)compressor objects are not thread safe: the compressor is only
+        # used under the write lock and each reader thread gets its own decompressor
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        logger.info(f"Compressed text store opened at {path}")
+    
+    def append(self, texts: List[str]) -> List[Tuple[int, int]]:
+        """Compress and append texts, returning an (offset, length) pair for each"""
+        with self._lock:
+            # Each text is compressed on its own so any one can be read back independently
+            frames = [self._compressor.compress(text.encode("utf-8")) for text in texts]
+            offset = os.fstat(self._fd).st_size
+            os.write(self._fd, b"".join(frames))
+        
+        locations = []
+        for frame in frames:
+            locations.append((offset, len(frame)))
+            offset += len(frame)
+        return locations
+    
+    def read(self, offset: int, length: int) -> str:
+        """Read and decompress a single text"""
+        # pread does not move a shared file position, so readers need no lock
+        frame = os.pread(self._fd, length, offset)
+        return self._get_decompressor().decompress(frame).decode("utf-8")
+    
+    def _get_decompressor(self) -> zstandard.ZstdDecompressor:
+        """Return the calling thread's decompressor"""
+        decompressor = getattr(self._local, "decompressor", None)
+        if decompressor is None:
+            decompressor = self._local.decompressor = zstandard.ZstdDecompressor()
+        return decompressor
+    
+    def close(self):
+        """Close the underlying file"""
+        os.close(self._fd)
@@ -2,20 +2,48 @@ import chromadb
 from chromadb.config import Settings as ChromaSettings
 from sentence_transformers import SentenceTransformer
 import numpy as np
-from typing import List, Dict, Any
+import torch
+from typing import List, Dict, Any, Iterable
 from loguru import logger
 import pickle
+import hashlib
 import os
+import threading
+from collections import OrderedDict
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+
+from app.core.query_batcher import QueryBatcher
+from app.core.text_store import CompressedTextStore
 
 class VectorStoreManager:
     def __init__(self, config):
         self.config = config
         self.embedding_model = None
+        self.device = None
         self.client = None
         self.collection = None
+        self.distance_space = None
+        self.text_store = None
+        
+        # Semantic cache of recent searches, bucketed by LSH signature
+        self._search_cache = OrderedDict()
+        self._search_cache_lock = threading.Lock()
+        self._search_cache_version = 0  # Bumped when the indexed documents change
+        self._lsh_planes = None
+        
+        # Per-instance LRU so repeated queries skip the encoder
+        self._query_embedding_cache = OrderedDict()
+        self._query_embedding_lock = threading.Lock()
         
         # Initialize embedding model
         self._init_embedding_model()
+        self._init_semantic_cache()
+        self._query_batcher = QueryBatcher(
+            self.create_embeddings,
+            max_batch_size=config.QUERY_BATCH_SIZE,
+            max_wait_ms=config.QUERY_BATCH_WAIT_MS
+        )
         
         # Initialize ChromaDB
         self._init_vector_store()
@@ -24,12 +52,48 @@ class VectorStoreManager:
         """Initialize sentence transformer model"""
         try:
             logger.info(f"Loading embedding model: {self.config.EMBEDDING_MODEL}")
-            self.embedding_model = SentenceTransformer(self.config.EMBEDDING_MODEL)
-            logger.info("Embedding model loaded successfully")
+            self.device = self.config.EMBEDDING_DEVICE or ("cuda" if torch.cuda.is_available() else "cpu")
+            self.embedding_model = SentenceTransformer(self.config.EMBEDDING_MODEL, device=self.device)
+            
+            # Half-precision weights halve memory traffic on GPU with negligible retrieval loss
+            if self.device.startswith("cuda") and self.config.EMBEDDING_HALF_PRECISION:
+                self._enable_half_precision()
+            elif self.device == "cpu" and self.config.EMBEDDING_QUANTIZE_CPU:
+                self._enable_int8_quantization()
+            logger.info(f"Embedding model loaded successfully on {self.device}")
         except Exception as e:
             logger.error(f"Failed to load embedding model: {e}")
             raise
     
+    def _enable_half_precision(self):
+        """Cast the encoder to bf16/fp16 and pool its token embeddings in fp32"""
+        dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+        
+        transformer = self.embedding_model[0]
+        transformer.to(dtype)
+        
+        # Upcast before pooling/normalization to avoid accumulation error
+        def upcast_token_embeddings(module, inputs, features):
+            features["token_embeddings"] = features["token_embeddings"].float()
+            return features
+        
+        transformer.register_forward_hook(upcast_token_embeddings)
+        logger.info(f"Embedding model running in {dtype}")
+    
+    def _enable_int8_quantization(self):
+        """Dynamically quantize the encoder's linear layers to int8 for CPU inference"""
+        transformer = self.embedding_model[0]
+        transformer.auto_model = torch.quantization.quantize_dynamic(
+            transformer.auto_model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+        logger.info("Embedding model quantized to int8 for CPU")
+    
+    def _init_semantic_cache(self):
+        """Create random hyperplanes used to hash query embeddings"""
+        dim = self.embedding_model.get_sentence_embedding_dimension()
+        rng = np.random.default_rng(0)
+        self._lsh_planes = rng.standard_normal((self.config.SEMANTIC_CACHE_PLANES, dim)).astype(np.float32)
+    
     def _init_vector_store(self):
         """Initialize ChromaDB client and collection"""
         try:
@@ -42,51 +106,191 @@ class VectorStoreManager:
                 settings=ChromaSettings(anonymized_telemetry=False)
             )
             
-            # Create or get collection
-            self.collection = self.client.get_or_create_collection(
-                name="tuk_documents",
-                metadata={"description": "TUK official documents"}
-            )
+            # Get the collection, passing HNSW metadata only when creating it:
+            # get_or_create_collection would overwrite the stored metadata of an
+            # existing collection without rebuilding its index.
+            try:
+                self.collection = self.client.get_collection(name="tuk_documents")
+            except ValueError:
+                self.collection = self.client.create_collection(
+                    name="tuk_documents",
+                    metadata={
+                        "description": "TUK official documents",
+                        # Embeddings are L2-normalized, so inner product ranks like cosine similarity
+                        "hnsw:space": "ip",
+                        "hnsw:M": self.config.HNSW_M,
+                        "hnsw:construction_ef": self.config.HNSW_CONSTRUCTION_EF,
+                        "hnsw:search_ef": self.config.HNSW_SEARCH_EF
+                    }
+                )
+            
+            # Chunk text lives in a compressed sidecar; Chroma keeps only its location.
+            # An existing sidecar is always opened so previously stored chunks stay readable.
+            text_store_path = os.path.join(self.config.VECTOR_DB_PATH, "documents.zst")
+            if self.config.COMPRESS_DOCUMENT_TEXT or os.path.exists(text_store_path):
+                self.text_store = CompressedTextStore(text_store_path)
+            
+            # Collections created before the switch to inner product keep their l2 space
+            self.distance_space = (self.collection.metadata or {}).get("hnsw:space", "l2")
             
-            logger.info("Vector store initialized successfully")
+            logger.info(f"Vector store initialized successfully ({self.distance_space} space)")
         except Exception as e:
             logger.error(f"Failed to initialize vector store: {e}")
             raise
     
-    def create_embeddings(self, texts: List[str]) -> np.ndarray:
+    def create_embeddings(self, texts: List[str], batch_size: int = None) -> np.ndarray:
         """Create embeddings for list of texts"""
-        return self.embedding_model.encode(texts, show_progress_bar=True)
+        if batch_size is None:
+            batch_size = self.config.EMBEDDING_BATCH_SIZE
+        
+        # inference_mode skips autograd bookkeeping entirely (stricter than no_grad)
+        with torch.inference_mode():
+            return self.embedding_model.encode(
+                texts,
+                batch_size=batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False
+            )
     
-    def add_documents(self, documents: List[Dict]):
-        """Add documents to vector store"""
+    def embed_query(self, query: str) -> np.ndarray:
+        """Return the (read-only, cached) embedding for a query string"""
+        # The normalized text is only the cache key; the original query is what gets encoded
+        cache_key = query.strip().lower()
+        with self._query_embedding_lock:
+            embedding = self._query_embedding_cache.get(cache_key)
+            if embedding is not None:
+                self._query_embedding_cache.move_to_end(cache_key)
+                return embedding
+        
+        embedding = self._encode_query(query)
+        
+        with self._query_embedding_lock:
+            self._query_embedding_cache[cache_key] = embedding
+            while len(self._query_embedding_cache) > self.config.QUERY_EMBEDDING_CACHE_SIZE:
+                self._query_embedding_cache.popitem(last=False)
+        return embedding
+    
+    def _encode_query(self, query: str) -> np.ndarray:
+        """Encode a single query"""
+        # Concurrent requests are coalesced into one encoder call by the batcher
+        embedding = self._query_batcher.encode(query)
+        embedding.setflags(write=False)  # Shared by every caller of the cache
+        return embedding
+    
+    def add_documents(self, documents: Iterable[Dict]):
+        """Add documents to vector store, replacing earlier chunks of the same files"""
         try:
-            texts = [doc["text"] for doc in documents]
-            metadatas = [doc["metadata"] for doc in documents]
-            ids = [f"doc_{i}" for i in range(len(documents))]
-            
-            # Generate embeddings
-            embeddings = self.create_embeddings(texts)
-            
-            # Add to collection
-            self.collection.add(
-                embeddings=embeddings.tolist(),
-                documents=texts,
-                metadatas=metadatas,
-                ids=ids
+            batch_size = self.config.VECTOR_ADD_BATCH_SIZE
+            documents = iter(documents)
+            total_count = 0
+            added_count = 0
+            ids_by_file = {}  # Every chunk ID seen per source file, to prune stale ones
+            
+            # Embed and insert one slice at a time to bound peak memory. A writer
+            # thread stores each slice while the next one is being read and embedded,
+            # so a streamed input keeps both busy.
+            with ThreadPoolExecutor(max_workers=1, thread_name_prefix="vector-writer") as writer:
+                pending_write = None
+                while True:
+                    slice_docs = list(islice(documents, batch_size))
+                    if not slice_docs:
+                        break
+                    total_count += len(slice_docs)
+                    
+                    # IDs are derived from content, so re-uploading the same corpus is a no-op
+                    unique_docs = {self._document_id(doc): doc for doc in slice_docs}
+                    for doc_id, doc in unique_docs.items():
+                        file_path = doc["metadata"].get("file_path")
+                        if file_path:
+                            ids_by_file.setdefault(file_path, set()).add(doc_id)
+                    
+                    existing_ids = set(self.collection.get(ids=list(unique_docs), include=[])["ids"])
+                    batch_ids = [doc_id for doc_id in unique_docs if doc_id not in existing_ids]
+                    if not batch_ids:
+                        continue
+                    
+                    batch = [unique_docs[doc_id] for doc_id in batch_ids]
+                    texts = [doc["text"] for doc in batch]
+                    
+                    # Generate embeddings
+                    embeddings = self.create_embeddings(texts)
+                    
+                    metadatas = [doc["metadata"] for doc in batch]
+                    stored_texts = texts
+                    if self.config.COMPRESS_DOCUMENT_TEXT:
+                        locations = self.text_store.append(texts)
+                        metadatas = [
+                            {**metadata, "text_offset": offset, "text_length": length}
+                            for metadata, (offset, length) in zip(metadatas, locations)
+                        ]
+                        stored_texts = None
+                    
+                    # Wait for the previous slice so at most one write is in flight
+                    if pending_write is not None:
+                        pending_write.result()
+                    
+                    # Upsert so a concurrent upload of the same chunks can't fail on duplicate IDs
+                    pending_write = writer.submit(
+                        self.collection.upsert,
+                        embeddings=embeddings.tolist(),
+                        documents=stored_texts,
+                        metadatas=metadatas,
+                        ids=batch_ids
+                    )
+                    added_count += len(batch_ids)
+                
+                if pending_write is not None:
+                    pending_write.result()
+            
+            # Only once the new chunks are stored, so an edited file is never missing from the index
+            removed_count = self._remove_stale_chunks(ids_by_file)
+            
+            logger.info(
+                f"Added {added_count} documents to vector store "
+                f"({total_count - added_count} already indexed, {removed_count} stale removed)"
             )
             
-            logger.info(f"Added {len(documents)} documents to vector store")
+            # Cached search results no longer reflect the collection
+            with self._search_cache_lock:
+                self._search_cache_version += 1
+                self._search_cache.clear()
         except Exception as e:
             logger.error(f"Error adding documents: {e}")
     
+    def _remove_stale_chunks(self, ids_by_file: Dict[str, set]) -> int:
+        """Delete chunks of re-indexed files that are not part of their new version"""
+        removed_count = 0
+        for file_path, current_ids in ids_by_file.items():
+            indexed_ids = self.collection.get(where={"file_path": file_path}, include=[])["ids"]
+            stale_ids = [doc_id for doc_id in indexed_ids if doc_id not in current_ids]
+            if stale_ids:
+                self.collection.delete(ids=stale_ids)
+                removed_count += len(stale_ids)
+        return removed_count
+    
+    @staticmethod
+    def _document_id(document: Dict) -> str:
+        """Stable ID from a chunk's source file, position and text"""
+        metadata = document["metadata"]
+        key = f"{metadata.get('file_path', '')}\0{metadata.get('chunk_id', '')}\0{document['text']}"
+        return f"doc_{hashlib.sha1(key.encode('utf-8')).hexdigest()}"
+    
     def search(self, query: str, n_results: int = None) -> List[Dict]:
         """Search for similar documents"""
         if n_results is None:
             n_results = self.config.TOP_K_RESULTS
         
         try:
-            # Create query embedding
-            query_embedding = self.embedding_model.encode([query])
+            # Create query embedding (cached across calls)
+            query_embedding = self.embed_query(query)[np.newaxis, :]
+            
+            # Near-duplicate queries reuse earlier results and skip the collection query
+            cache_key = (self._lsh_signature(query_embedding[0]), n_results)
+            cached_results = self._get_cached_search(cache_key, query_embedding[0])
+            if cached_results is not None:
+                return cached_results
+            cache_version = self._search_cache_version
             
             # Search
             results = self.collection.query(
@@ -98,18 +302,69 @@ class VectorStoreManager:
             # Format results
             formatted_results = []
             if results["documents"]:
-                for i in range(len(results["documents"][0])):
-                    formatted_results.append({
-                        "content": results["documents"][0][i],
-                        "metadata": results["metadatas"][0][i],
-                        "similarity_score": 1 - results["distances"][0][i]  # Convert distance to similarity
-                    })
+                docs = results["documents"][0]
+                metas = results["metadatas"][0]
+                distances = np.asarray(results["distances"][0])
+                # Keep the l2 score scale in both spaces: for unit vectors l2 gives
+                # 1 - d = 2*cos - 1, and ip distance is 1 - dot, so 1 - 2*d matches it
+                if self.distance_space == "ip":
+                    similarities = 1.0 - 2.0 * distances
+                else:
+                    similarities = 1.0 - distances
+                # Only the returned texts are read back from the sidecar
+                formatted_results = [
+                    self._format_result(doc, meta, float(similarity))
+                    for doc, meta, similarity in zip(docs, metas, similarities)
+                ]
             
+            self._cache_search(cache_key, query_embedding[0], formatted_results, cache_version)
             return formatted_results
         except Exception as e:
             logger.error(f"Search error: {e}")
             return []
     
+    def _format_result(self, document, metadata: Dict, similarity: float) -> Dict:
+        """Build a search result, loading compressed text when Chroma has no document"""
+        if "text_offset" in metadata:
+            metadata = dict(metadata)
+            offset = metadata.pop("text_offset")
+            length = metadata.pop("text_length")
+            if document is None:
+                document = self.text_store.read(offset, length)
+        
+        return {"content": document, "metadata": metadata, "similarity_score": similarity}
+    
+    def _lsh_signature(self, embedding: np.ndarray) -> bytes:
+        """Hash an embedding to the side of each random hyperplane it falls on"""
+        return np.packbits(self._lsh_planes @ embedding > 0).tobytes()
+    
+    def _get_cached_search(self, cache_key: tuple, embedding: np.ndarray):
+        """Return cached results if the bucket holds a sufficiently similar query"""
+        with self._search_cache_lock:
+            entry = self._search_cache.get(cache_key)
+            if entry is None:
+                return None
+            
+            cached_embedding, results = entry
+            # Embeddings are normalized, so the dot product is the cosine similarity
+            if float(np.dot(cached_embedding, embedding)) < self.config.SEMANTIC_CACHE_THRESHOLD:
+                return None
+            
+            self._search_cache.move_to_end(cache_key)
+            return results
+    
+    def _cache_search(self, cache_key: tuple, embedding: np.ndarray, results: List[Dict], cache_version: int):
+        """Store search results, evicting the least recently used bucket when full"""
+        with self._search_cache_lock:
+            # Documents were added while this search ran, so its results may be stale
+            if cache_version != self._search_cache_version:
+                return
+            
+            self._search_cache[cache_key] = (embedding, results)
+            self._search_cache.move_to_end(cache_key)
+            while len(self._search_cache) > self.config.SEMANTIC_CACHE_SIZE:
+                self._search_cache.popitem(last=False)
+    
     def get_collection_stats(self) -> Dict:
         """Get statistics about the collection"""
         try:
@@ -5,6 +5,7 @@ from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 from typing import Optional, List
 import uvicorn
+import asyncio
 from loguru import logger
 import os
 
@@ -13,6 +14,7 @@ from app.core.document_processor import DocumentProcessor
 from app.core.vector_store import VectorStoreManager
 from app.core.llm_manager import LLMManager
 from app.core.rag_pipeline import RAGPipeline
+from app.core.database import DatabaseManager
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -24,6 +26,7 @@ app = FastAPI(
 # Initialize components (singleton pattern)
 vector_store = None
 llm_manager = None
+db_manager = None
 rag_pipeline = None
 
 class QueryRequest(BaseModel):
@@ -43,15 +46,20 @@ class FeedbackRequest(BaseModel):
 @app.on_event("startup")
 async def startup_event():
     """Initialize system components on startup"""
-    global vector_store, llm_manager, rag_pipeline
+    global vector_store, llm_manager, db_manager, rag_pipeline
     
     try:
         logger.info("Starting TUK-ConvoSearch...")
         
+        # Load the interface once instead of reading it on every request
+        with open("app/web/templates/index.html", "rb") as f:
+            app.state.index_html = f.read()
+        
         # Initialize components
         vector_store = VectorStoreManager(settings)
         llm_manager = LLMManager(settings)
-        rag_pipeline = RAGPipeline(settings, vector_store, llm_manager)
+        db_manager = DatabaseManager(settings)
+        rag_pipeline = RAGPipeline(settings, vector_store, llm_manager, db_manager)
         
         logger.info("TUK-ConvoSearch started successfully!")
         
@@ -59,12 +67,16 @@ async def startup_event():
         logger.error(f"Failed to start application: {e}")
         raise
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush pending history writes and release the database on shutdown"""
+    if db_manager:
+        db_manager.close()
+
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     """Serve the main interface"""
-    with open("app/web/templates/index.html", "r") as f:
-        html_content = f.read()
-    return HTMLResponse(content=html_content)
+    return HTMLResponse(content=app.state.index_html)
 
 @app.post("/api/query")
 async def query_endpoint(request: QueryRequest):
@@ -73,7 +85,9 @@ async def query_endpoint(request: QueryRequest):
         if not rag_pipeline:
             raise HTTPException(status_code=500, detail="System not initialized")
         
-        result = rag_pipeline.process_query(request.question)
+        # Run the blocking pipeline in a worker thread so the event loop keeps serving requests
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(None, rag_pipeline.process_query, request.question, None, request.user_id)
         
         # Log the query
         logger.info(f"User query: {request.question}")
@@ -84,6 +98,25 @@ async def query_endpoint(request: QueryRequest):
         logger.error(f"Query error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _index_directory(raw_dir: str) -> int:
+    """Stream parsed chunks into the vector store, returning how many were indexed"""
+    processor = DocumentProcessor(settings)
+    chunk_count = 0
+    
+    def iter_documents():
+        nonlocal chunk_count
+        for chunks in processor.iter_directory(raw_dir):
+            chunk_count += len(chunks)
+            for doc in chunks:
+                yield {"text": doc.page_content, "metadata": doc.metadata}
+    
+    # One add_documents call consumes the stream, so parsing, embedding and
+    # writing overlap instead of waiting for every file to be parsed
+    vector_store.add_documents(iter_documents())
+    
+    logger.info(f"Total chunks indexed: {chunk_count}")
+    return chunk_count
+
 @app.post("/api/upload")
 async def upload_documents():
     """Upload and process documents"""
@@ -93,27 +126,20 @@ async def upload_documents():
         if not os.path.exists(raw_dir):
             return {"message": f"No documents found in {raw_dir}. Please add documents first."}
         
-        # Process documents
-        processor = DocumentProcessor(settings)
-        documents = processor.process_directory(raw_dir)
+        # Parse files in worker processes and embed them in a thread, off the event loop
+        loop = asyncio.get_running_loop()
+        chunk_count = await loop.run_in_executor(None, _index_directory, raw_dir)
         
-        if not documents:
+        if not chunk_count:
             return {"message": "No documents processed. Check file formats."}
         
-        # Convert to vector store format
-        doc_dicts = []
-        for i, doc in enumerate(documents):
-            doc_dicts.append({
-                "text": doc.page_content,
-                "metadata": doc.metadata
-            })
-        
-        # Add to vector store
-        vector_store.add_documents(doc_dicts)
+        # Cached answers may be stale now that the index has changed
+        if rag_pipeline:
+            rag_pipeline.invalidate_cache()
         
         return {
-            "message": f"Successfully processed {len(documents)} document chunks",
-            "chunks": len(documents)
+            "message": f"Successfully processed {chunk_count} document chunks",
+            "chunks": chunk_count
         }
         
     except Exception as e:
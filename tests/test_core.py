@@ -0,0 +1,100 @@
+"""
+Unit tests for TUK-ConvoSearch core components that run without the server
+"""
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import numpy as np
+import random
+import threading
+
+from app.core.database import DatabaseManager
+from app.core.query_batcher import QueryBatcher
+from app.core.text_store import CompressedTextStore
+
+def test_query_batcher_returns_each_caller_its_own_row():
+    """Concurrent callers share batches but each gets the row for its own text"""
+    batch_sizes = []
+    
+    def encode(texts):
+        batch_sizes.append(len(texts))
+        return np.array([[float(text)] for text in texts])
+    
+    batcher = QueryBatcher(encode, max_batch_size=8, max_wait_ms=20)
+    start = threading.Barrier(32)
+    
+    def call(i):
+        start.wait()
+        return batcher.encode(str(i))
+    
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        results = list(executor.map(call, range(32)))
+    
+    assert [float(row[0]) for row in results] == list(range(32))
+    assert sum(batch_sizes) == 32
+    assert max(batch_sizes) <= 8
+
+def test_query_batcher_propagates_encode_errors():
+    """A failing encode raises in the caller instead of hanging it"""
+    def encode(texts):
+        raise RuntimeError("encoder down")
+    
+    batcher = QueryBatcher(encode)
+    try:
+        batcher.encode("hello")
+    except RuntimeError as e:
+        assert str(e) == "encoder down"
+    else:
+        raise AssertionError("expected RuntimeError")
+
+def test_text_store_round_trip_under_concurrent_readers(tmp_path):
+    """Texts read back intact while many threads read at once"""
+    store = CompressedTextStore(str(tmp_path / "documents.zst"))
+    rng = random.Random(0)
+    texts = [
+        "".join(rng.choice("abcdefghij .") for _ in range(size))
+        for size in [1000] * 200 + [200_000] * 5
+    ]
+    
+    # Two appends so offsets continue past the first batch
+    locations = store.append(texts[:100]) + store.append(texts[100:])
+    
+    def read_many(seed):
+        picker = random.Random(seed)
+        for _ in range(200):
+            i = picker.randrange(len(texts))
+            assert store.read(*locations[i]) == texts[i]
+    
+    try:
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            list(executor.map(read_many, range(16)))
+    finally:
+        store.close()
+
+def test_history_flush_keeps_rows_around_a_duplicate(tmp_path):
+    """One duplicate conversation_id in a flushed batch doesn't lose the other rows"""
+    config = SimpleNamespace(ENABLE_HISTORY=True, DATABASE_URL=f"sqlite:///{tmp_path / 'history.db'}")
+    db_manager = DatabaseManager(config)
+    
+    def conversation(conversation_id):
+        return {
+            "conversation_id": conversation_id,
+            "user_id": "tester",
+            "query": f"question {conversation_id}",
+            "answer": "answer",
+            "confidence": 80,
+            "sources_used": ["fees.pdf"]
+        }
+    
+    assert db_manager.save_conversation(conversation("a"))["success"]
+    
+    # Hold the writer so all three rows are flushed as one batch
+    gate = threading.Event()
+    db_manager._executor.submit(gate.wait)
+    for conversation_id in ("b", "a", "c"):
+        assert db_manager.save_conversation_async(conversation(conversation_id))["success"]
+    gate.set()
+    db_manager.close()
+    
+    saved = db_manager.get_conversation_history(user_id="tester")
+    assert sorted(row["conversation_id"] for row in saved) == ["a", "b", "c"]
+    assert saved[0]["sources_used"] == ["fees.pdf"]